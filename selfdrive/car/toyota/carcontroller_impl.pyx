@@ -0,0 +1,382 @@
+# distutils: language = c++
+# cython: language_level = 3
+cimport cython
+from libc.limits cimport INT_MIN, INT_MAX
+from libc.math cimport fmin, fmax, isnan, rint
+from libc.string cimport memcpy
+from math import gcd
+
+from cereal import car
+from selfdrive.car import create_gas_interceptor_command, make_can_msg
+from selfdrive.car.toyota.toyotacan import create_steer_command, create_ui_command, \
+                                           create_accel_command, create_acc_cancel_command, \
+                                           create_fcw_command, create_lta_steer_command, STEERING_LKA
+from selfdrive.car.toyota.values import CAR, STATIC_DSU_MSGS, NO_STOP_TIMER_CAR, TSS2_CAR, \
+                                        MIN_ACC_SPEED, PEDAL_TRANSITION, CarControllerParams
+from opendbc.can.packer import CANPacker
+VisualAlert = car.CarControl.HUDControl.VisualAlert
+
+# raw enum values, compared against hud_alert.raw as plain ints
+cdef int ALERT_FCW = VisualAlert.fcw
+cdef int ALERT_STEER_REQUIRED = VisualAlert.steerRequired
+cdef int ALERT_LDW = VisualAlert.ldw
+
+# actuator fields update() doesn't limit, copied from the input as they are
+ACTUATORS_PASSTHROUGH = tuple(f for f in car.CarControl.Actuators.schema.fields if f not in ('steer', 'accel', 'gas'))
+
+cdef double MAX_INTERCEPTOR_GAS = 0.5
+cdef double PEDAL_XP[3]
+PEDAL_XP[:] = [0.0, MIN_ACC_SPEED, MIN_ACC_SPEED + PEDAL_TRANSITION]
+
+# toyota checksum covers the length and address bytes too
+cdef enum:
+  LKA_SIZE = 5
+cdef int LKA_CHECKSUM_BASE = LKA_SIZE + (STEERING_LKA >> 8) + (STEERING_LKA & 0xFF)
+
+# most control messages update() sends in one frame: STEERING_LKA, STEERING_LTA,
+# ACC_CONTROL or PCM_CRUISE, GAS_COMMAND, LKAS_HUD and ACC_HUD
+cdef enum:
+  MAX_CONTROL_MSGS = 6
+
+# car features that are fixed after fingerprinting
+cdef enum:
+  F_DSU = 1 << 0
+  F_LONG = 1 << 1
+  F_GAS_INTERCEPTOR = 1 << 2
+  F_TSS2 = 1 << 3
+  F_NO_STOP_TIMER = 1 << 4
+  F_ACC_CANCEL = 1 << 5
+
+
+cpdef inline double sat(double x, double lo, double hi) nogil:
+  # same as common.numpy_fast.clip, including a nan x saturating to hi
+  return fmax(lo, fmin(hi, x))
+
+
+cpdef inline int iround(double x) except? -1 nogil:
+  # rint rounds half to even, like python's round(). casting nan, inf or an out of
+  # range value to int is undefined, raise like int(round(x)) does instead
+  cdef double r = rint(x)
+  if isnan(r):
+    with gil:
+      raise ValueError("cannot convert float NaN to integer")
+  if not INT_MIN <= r <= INT_MAX:
+    with gil:
+      raise OverflowError("cannot convert %f to int" % x)
+  return <int>r
+
+
+@cython.cdivision(True)
+cpdef inline double interp3(double x, double x0, double x1, double x2, double y0, double y1, double y2) nogil:
+  # common.numpy_fast.interp specialized to a 3 point table, written so a nan x
+  # returns y0 like it does there
+  if not x > x0:
+    return y0
+  elif x <= x1:
+    return (x - x0) * (y1 - y0) / (x1 - x0) + y0
+  elif x <= x2:
+    return (x - x1) * (y2 - y1) / (x2 - x1) + y1
+  else:
+    return y2
+
+
+cpdef int apply_toyota_steer_torque_limits(int apply_torque, int apply_torque_last, double motor_torque,
+                                           int steer_max, int delta_up, int delta_down, int error_max) except? -1 nogil:
+  # same as selfdrive.car.apply_toyota_steer_torque_limits, with the limits passed as scalars
+  cdef double torque
+
+  # limits due to comparison of commanded torque VS motor reported torque
+  cdef double max_lim = fmin(fmax(motor_torque + error_max, error_max), steer_max)
+  cdef double min_lim = fmax(fmin(motor_torque - error_max, -error_max), -steer_max)
+
+  torque = sat(apply_torque, min_lim, max_lim)
+
+  # slow rate if steer torque increases in magnitude
+  if apply_torque_last > 0:
+    torque = sat(torque, fmax(apply_torque_last - delta_down, -delta_up), apply_torque_last + delta_up)
+  else:
+    torque = sat(torque, apply_torque_last - delta_up, fmin(apply_torque_last + delta_down, delta_up))
+
+  return iround(torque)
+
+
+cdef struct ControllerLimits:
+  int steer_max
+  int steer_delta_up
+  int steer_delta_down
+  int steer_error_max
+  double accel_min
+  double accel_max
+
+
+# everything update() carries over between frames
+cdef struct ControllerState:
+  int last_steer
+  bint last_standstill
+  bint standstill_req
+  bint alert_active
+  double gas
+  double accel
+
+
+cdef class CarController:
+  cdef public:
+    bint steer_rate_limited
+    object CP
+    object packer
+
+  # exposed so tests can check the fast paths are actually in use
+  cdef readonly:
+    bint lka_fast
+    list lta_msgs
+    int dsu_period
+
+  cdef:
+    ControllerState st
+    ControllerLimits limits
+    double pedal_fp[3]
+    int flags
+    list dsu_schedule
+    list actuators_out
+    int out_idx
+    list sendbuf
+    int sendbuf_n
+    unsigned char lka_dat[LKA_SIZE]
+
+  def __init__(self, dbc_name, CP, VM):
+    self.CP = CP
+    self.st.last_steer = 0
+    self.st.last_standstill = False
+    self.st.standstill_req = False
+    self.st.alert_active = False
+    self.st.gas = 0
+    self.st.accel = 0
+    self.steer_rate_limited = False
+
+    # CarControllerParams is a python class, copy the limits into C once
+    self.limits.steer_max = CarControllerParams.STEER_MAX
+    self.limits.steer_delta_up = CarControllerParams.STEER_DELTA_UP
+    self.limits.steer_delta_down = CarControllerParams.STEER_DELTA_DOWN
+    self.limits.steer_error_max = CarControllerParams.STEER_ERROR_MAX
+    self.limits.accel_min = CarControllerParams.ACCEL_MIN
+    self.limits.accel_max = CarControllerParams.ACCEL_MAX
+
+    # the fingerprint never changes, resolve everything that depends on it once
+    # RAV4 has very sensitive gas pedal
+    if CP.carFingerprint in (CAR.RAV4, CAR.RAV4H, CAR.HIGHLANDER, CAR.HIGHLANDERH):
+      self.pedal_fp = [0.15, 0.3, 0.0]
+    elif CP.carFingerprint in (CAR.COROLLA,):
+      self.pedal_fp = [0.3, 0.4, 0.0]
+    else:
+      self.pedal_fp = [0.4, 0.5, 0.0]
+
+    self.flags = 0
+    if CP.enableDsu:
+      self.flags |= F_DSU
+    if CP.openpilotLongitudinalControl:
+      self.flags |= F_LONG
+    if CP.enableGasInterceptor:
+      self.flags |= F_GAS_INTERCEPTOR
+    if CP.carFingerprint in TSS2_CAR:
+      self.flags |= F_TSS2
+    if CP.carFingerprint in NO_STOP_TIMER_CAR:
+      self.flags |= F_NO_STOP_TIMER
+    # Lexus IS uses a different cancellation message
+    if CP.carFingerprint in (CAR.LEXUS_IS, CAR.LEXUS_RC):
+      self.flags |= F_ACC_CANCEL
+
+    # static msgs repeat with a period of the lcm of their frame steps, build the
+    # messages due at each frame of that period up front
+    static_msgs = []
+    if CP.enableDsu:
+      static_msgs = [(make_can_msg(addr, vl, bus), fr_step) for (addr, cars, bus, fr_step, vl) in STATIC_DSU_MSGS
+                     if CP.carFingerprint in cars]
+    self.dsu_period = 1
+    for _, fr_step in static_msgs:
+      self.dsu_period = self.dsu_period * fr_step // gcd(self.dsu_period, fr_step)
+    self.dsu_schedule = [[msg for msg, fr_step in static_msgs if k % fr_step == 0] for k in range(self.dsu_period)]
+
+    # reused every frame, sized for the most messages a single frame can send
+    self.sendbuf = [None] * (MAX_CONTROL_MSGS + max(len(msgs) for msgs in self.dsu_schedule))
+    self.sendbuf_n = 0
+
+    self.packer = CANPacker(dbc_name)
+
+    # STEERING_LKA is sent every frame, patch the signals that change into a packed template instead
+    # of going through the packer. The layout is checked against the packer, which stays the fallback
+    self.lka_fast = False
+    tpl = create_steer_command(self.packer, 0, 0, 0)[2]
+    if len(tpl) == LKA_SIZE:
+      memcpy(self.lka_dat, <const char *>tpl, LKA_SIZE)
+      self.lka_fast = True
+      self.lka_fast = all(self.steer_command(*args) == create_steer_command(self.packer, *args)
+                          for args in ((1, 1, 1), (-1500, 1, 63), (1500, 0, 42), (-1, 0, 64)))
+
+    # STEERING_LTA is only ever sent zeroed, so its counter is the only input. Pack every message
+    # once, as long as the counter wraps within a byte
+    self.lta_msgs = None
+    if self.flags & F_TSS2:
+      lta_msgs = [create_lta_steer_command(self.packer, 0, 0, cnt) for cnt in range(256)]
+      if all(create_lta_steer_command(self.packer, 0, 0, cnt + 256) == lta_msgs[cnt] for cnt in (0, 1, 127, 255)):
+        self.lta_msgs = lta_msgs
+
+    # output actuators are written into one of two preallocated messages instead of copying the
+    # input every frame, alternating on every call so the previous call's output stays valid
+    # while it's used, whatever frames the caller passes
+    self.actuators_out = [car.CarControl.Actuators.new_message() for _ in range(2)]
+    self.out_idx = 0
+
+  cdef inline void send(self, msg) except *:
+    if self.sendbuf_n >= len(self.sendbuf):
+      raise IndexError("CAN send buffer full, update MAX_CONTROL_MSGS")
+    self.sendbuf[self.sendbuf_n] = msg
+    self.sendbuf_n += 1
+
+  cpdef list steer_command(self, int steer, int steer_req, int counter):
+    if not self.lka_fast:
+      return create_steer_command(self.packer, steer, steer_req, counter)
+
+    cdef unsigned char *dat = self.lka_dat
+    # SET_ME_1, 6 bit COUNTER, STEER_REQUEST
+    dat[0] = (dat[0] & 0x80) | ((counter & 0x3F) << 1) | (steer_req & 0x1)
+    # big endian STEER_TORQUE_CMD
+    dat[1] = (steer >> 8) & 0xFF
+    dat[2] = steer & 0xFF
+    dat[4] = (LKA_CHECKSUM_BASE + dat[0] + dat[1] + dat[2] + dat[3]) & 0xFF
+    return [STEERING_LKA, 0, (<char *>dat)[:LKA_SIZE], 0]
+
+  cpdef list lta_steer_command(self, int counter):
+    if self.lta_msgs is None:
+      return create_lta_steer_command(self.packer, 0, 0, counter)
+    return self.lta_msgs[counter & 0xFF]
+
+  def update(self, enabled, active, CS, int frame, actuators, pcm_cancel_cmd, hud_alert,
+             left_line, right_line, lead, left_lane_depart, right_lane_depart):
+    cdef int new_steer, apply_steer, apply_steer_req
+    cdef double PEDAL_SCALE, pedal_offset, pedal_command, interceptor_gas_cmd, pcm_accel_cmd
+    cdef bint fcw_alert, steer_alert, alert, send_ui
+
+    # message schedule for this frame
+    cdef bint tick2 = (frame & 1) == 0
+    cdef bint tick3 = frame % 3 == 0
+    cdef bint tick100 = frame % 100 == 0
+
+    # read every capnp field once, each access goes through a property lookup
+    out = CS.out
+    cdef double v_ego = out.vEgo
+    cdef double steer_eps = out.steeringTorqueEps
+    cdef bint standstill = out.standstill
+
+    cdef int flags = self.flags
+    cdef ControllerState *st = &self.st
+    cdef double steer_max = self.limits.steer_max
+
+    # gas and brake
+    if flags & F_GAS_INTERCEPTOR and active:
+      PEDAL_SCALE = interp3(v_ego, PEDAL_XP[0], PEDAL_XP[1], PEDAL_XP[2], self.pedal_fp[0], self.pedal_fp[1], self.pedal_fp[2])
+      # offset for creep and windbrake
+      pedal_offset = interp3(v_ego, 0.0, 2.3, PEDAL_XP[2], -.4, 0.0, 0.2)
+      pedal_command = PEDAL_SCALE * (actuators.accel + pedal_offset)
+      interceptor_gas_cmd = sat(pedal_command, 0., MAX_INTERCEPTOR_GAS)
+    else:
+      interceptor_gas_cmd = 0.
+    pcm_accel_cmd = sat(actuators.accel, self.limits.accel_min, self.limits.accel_max)
+
+    # steer torque
+    new_steer = iround(actuators.steer * steer_max)
+    apply_steer = apply_toyota_steer_torque_limits(new_steer, st.last_steer, steer_eps, self.limits.steer_max,
+                                                   self.limits.steer_delta_up, self.limits.steer_delta_down,
+                                                   self.limits.steer_error_max)
+    self.steer_rate_limited = new_steer != apply_steer
+
+    # Cut steering while we're in a known fault state (2s)
+    cdef int steer_state = CS.steer_state
+    if not active or steer_state == 9 or steer_state == 25:
+      apply_steer = 0
+      apply_steer_req = 0
+    else:
+      apply_steer_req = 1
+
+    # TODO: probably can delete this. CS.pcm_acc_status uses a different signal
+    # than CS.cruiseState.enabled. confirm they're not meaningfully different
+    if not enabled and CS.pcm_acc_status:
+      pcm_cancel_cmd = 1
+
+    # on entering standstill, send standstill request
+    if standstill and not st.last_standstill and not flags & F_NO_STOP_TIMER:
+      st.standstill_req = True
+    if CS.pcm_acc_status != 8:
+      # pcm entered standstill or it's disabled
+      st.standstill_req = False
+
+    st.last_steer = apply_steer
+    st.last_standstill = standstill
+
+    self.sendbuf_n = 0
+
+    #*** control msgs ***
+    #print("steer {0} {1} {2} {3}".format(apply_steer, min_lim, max_lim, CS.steer_torque_motor)
+
+    # toyota can trace shows this message at 42Hz, with counter adding alternatively 1 and 2;
+    # sending it at 100Hz seem to allow a higher rate limit, as the rate limit seems imposed
+    # on consecutive messages
+    self.send(self.steer_command(apply_steer, apply_steer_req, frame))
+    if tick2 and flags & F_TSS2:
+      self.send(self.lta_steer_command(frame // 2))
+
+    # LTA mode. Set ret.steerControlType = car.CarParams.SteerControlType.angle and whitelist 0x191 in the panda
+    # if frame % 2 == 0:
+    #   self.send(create_steer_command(self.packer, 0, 0, frame // 2))
+    #   self.send(create_lta_steer_command(self.packer, actuators.steeringAngleDeg, apply_steer_req, frame // 2))
+
+    # we can spam can to cancel the system even if we are using lat only control
+    if (tick3 and flags & F_LONG) or pcm_cancel_cmd:
+      lead = lead or v_ego < 12.    # at low speed we always assume the lead is present so ACC can be engaged
+
+      if pcm_cancel_cmd and flags & F_ACC_CANCEL:
+        self.send(create_acc_cancel_command(self.packer))
+      elif flags & F_LONG:
+        self.send(create_accel_command(self.packer, pcm_accel_cmd, pcm_cancel_cmd, st.standstill_req, lead, CS.acc_type))
+        st.accel = pcm_accel_cmd
+      else:
+        self.send(create_accel_command(self.packer, 0, pcm_cancel_cmd, False, lead, CS.acc_type))
+
+    if tick2 and flags & F_GAS_INTERCEPTOR and flags & F_LONG:
+      # send exactly zero if gas cmd is zero. Interceptor will send the max between read value and gas cmd.
+      # This prevents unexpected pedal range rescaling
+      self.send(create_gas_interceptor_command(self.packer, interceptor_gas_cmd, frame // 2))
+      st.gas = interceptor_gas_cmd
+
+    # ui mesg is at 1Hz but we send asap if:
+    # - there is something to display
+    # - there is something to stop displaying
+    cdef int visual_alert = hud_alert.raw
+    fcw_alert = visual_alert == ALERT_FCW
+    steer_alert = visual_alert == ALERT_STEER_REQUIRED or visual_alert == ALERT_LDW
+    alert = fcw_alert or steer_alert
+
+    # forcing the pcm to disengage causes a bad fault sound so play a good sound instead
+    send_ui = alert != st.alert_active or pcm_cancel_cmd
+    st.alert_active = alert
+
+    if (tick100 or send_ui):
+      self.send(create_ui_command(self.packer, steer_alert, pcm_cancel_cmd, left_line, right_line, left_lane_depart, right_lane_depart, enabled))
+
+    if tick100 and flags & F_DSU:
+      self.send(create_fcw_command(self.packer, fcw_alert))
+
+    # *** static msgs ***
+    for msg in self.dsu_schedule[frame % self.dsu_period]:
+      self.send(msg)
+
+    self.out_idx ^= 1
+    new_actuators = self.actuators_out[self.out_idx]
+    for f in ACTUATORS_PASSTHROUGH:
+      setattr(new_actuators, f, getattr(actuators, f))
+    new_actuators.steer = apply_steer / steer_max
+    new_actuators.accel = st.accel
+    new_actuators.gas = st.gas
+
+    can_sends = self.sendbuf[:self.sendbuf_n]
+
+    return new_actuators, can_sends
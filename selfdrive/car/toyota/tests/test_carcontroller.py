@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+from cereal import car
+from common.numpy_fast import clip, interp
+from opendbc.can.packer import CANPacker
+from selfdrive.car import make_can_msg, apply_toyota_steer_torque_limits as apply_toyota_steer_torque_limits_py
+from selfdrive.car.toyota.carcontroller_impl import CarController, apply_toyota_steer_torque_limits, interp3, \
+                                                      iround, sat
+from selfdrive.car.toyota.toyotacan import create_steer_command, create_lta_steer_command, STEERING_LKA, \
+                                             STEERING_LTA, ACC_CONTROL, ACC_HUD, LKAS_HUD
+from selfdrive.car.toyota.values import CAR, DBC, STATIC_DSU_MSGS, CarControllerParams
+
+# shared interceptor message, packed by name in selfdrive.car.create_gas_interceptor_command
+GAS_COMMAND = 0x200
+
+
+class CarStateStub:
+  def __init__(self):
+    self.out = car.CarState.new_message()
+    self.steer_state = 0
+    self.pcm_acc_status = 8
+    self.acc_type = 1
+
+
+def make_controller(fingerprint, dsu=False, long=False, gas=False):
+  CP = car.CarParams.new_message()
+  CP.carFingerprint = fingerprint
+  CP.enableDsu = dsu
+  CP.openpilotLongitudinalControl = long
+  CP.enableGasInterceptor = gas
+  return CarController(DBC[fingerprint]['pt'], CP, None)
+
+
+def run_update(CC, frame, actuators=None, pcm_cancel_cmd=False):
+  CC_msg = car.CarControl.new_message()
+  if actuators is None:
+    actuators = CC_msg.actuators
+  return CC.update(True, True, CarStateStub(), frame, actuators, pcm_cancel_cmd,
+                   CC_msg.hudControl.visualAlert, False, False, False, False, False)
+
+
+class TestToyotaCarController(unittest.TestCase):
+
+  def test_steer_torque_limits(self):
+    P = CarControllerParams
+    for _ in range(10000):
+      new_steer = random.randint(-P.STEER_MAX - 100, P.STEER_MAX + 100)
+      last_steer = random.randint(-P.STEER_MAX, P.STEER_MAX)
+      motor_torque = random.uniform(-2000, 2000)
+
+      expected = apply_toyota_steer_torque_limits_py(new_steer, last_steer, motor_torque, P)
+      ret = apply_toyota_steer_torque_limits(new_steer, last_steer, motor_torque, P.STEER_MAX,
+                                             P.STEER_DELTA_UP, P.STEER_DELTA_DOWN, P.STEER_ERROR_MAX)
+      self.assertEqual(expected, ret)
+
+  def test_interp3(self):
+    xp = [0.0, 2.3, 13.5]
+    fp = [-0.4, 0.0, 0.2]
+    for x in xp + [float('nan')] + [random.uniform(-5, 20) for _ in range(1000)]:
+      self.assertAlmostEqual(interp(x, xp, fp), interp3(x, *xp, *fp))
+
+  def test_sat_iround(self):
+    for x in [-0.5, 0.5, 1.5, 2.5, -2.5] + [random.uniform(-5, 5) for _ in range(1000)]:
+      self.assertEqual(clip(x, -3.5, 1.5), sat(x, -3.5, 1.5))
+      self.assertEqual(round(x), iround(x))
+
+    # int(round(x)) raises on these, iround must not wrap them to INT_MIN
+    self.assertRaises(ValueError, iround, float('nan'))
+    for x in (float('inf'), float('-inf'), 3e9, -3e9):
+      self.assertRaises(OverflowError, iround, x)
+
+  def test_steer_command(self):
+    CC = make_controller(CAR.PRIUS)
+    packer = CANPacker(DBC[CAR.PRIUS]['pt'])
+    self.assertTrue(CC.lka_fast)
+
+    for frame in range(1000):
+      steer = random.randint(-CarControllerParams.STEER_MAX, CarControllerParams.STEER_MAX)
+      steer_req = random.randint(0, 1)
+      self.assertEqual(create_steer_command(packer, steer, steer_req, frame), CC.steer_command(steer, steer_req, frame))
+
+  def test_lta_steer_command(self):
+    CC = make_controller(CAR.COROLLA_TSS2)
+    packer = CANPacker(DBC[CAR.COROLLA_TSS2]['pt'])
+    self.assertIsNotNone(CC.lta_msgs)
+
+    for frame in range(1000):
+      self.assertEqual(create_lta_steer_command(packer, 0, 0, frame), CC.lta_steer_command(frame))
+
+  def test_max_control_msgs(self):
+    # every control message is due on frame 0, none of them may get dropped
+    CC = make_controller(CAR.COROLLA_TSS2, dsu=True, long=True, gas=True)
+    _, can_sends = run_update(CC, 0, pcm_cancel_cmd=True)
+    self.assertEqual({STEERING_LKA, STEERING_LTA, ACC_CONTROL, GAS_COMMAND, LKAS_HUD, ACC_HUD},
+                     {msg[0] for msg in can_sends})
+
+  def test_dsu_schedule(self):
+    CC = make_controller(CAR.PRIUS, dsu=True)
+    static_addrs = {addr for addr, _, _, _, _ in STATIC_DSU_MSGS}
+    self.assertGreater(CC.dsu_period, 1)
+
+    # two full periods, so the schedule wraps around once
+    for frame in range(2 * CC.dsu_period):
+      _, can_sends = run_update(CC, frame)
+      expected = [make_can_msg(addr, vl, bus) for addr, cars, bus, fr_step, vl in STATIC_DSU_MSGS
+                  if frame % fr_step == 0 and CAR.PRIUS in cars]
+      self.assertEqual(expected, [msg for msg in can_sends if msg[0] in static_addrs])
+
+  def test_actuators_output(self):
+    CC = make_controller(CAR.PRIUS, long=True)
+    fields = [f for f in car.CarControl.Actuators.schema.fields if f not in ('steer', 'accel', 'gas')]
+
+    # the last call's output must stay valid while the next one runs, whatever frames the caller passes
+    actuators = car.CarControl.new_message().actuators
+    actuators.brake = 0.3
+    actuators.steeringAngleDeg = 12.5
+    actuators.speed = 3.0
+    actuators.longControlState = 'pid'
+    actuators_n, _ = run_update(CC, 0, actuators)
+    snapshot = actuators_n.to_dict()
+
+    actuators_next = car.CarControl.new_message().actuators
+    actuators_next.steeringAngleDeg = -4.0
+    actuators_next.longControlState = 'stopping'
+    run_update(CC, 2, actuators_next)
+    self.assertEqual(snapshot, actuators_n.to_dict())
+
+    # every field the controller doesn't limit is passed through
+    for f in fields:
+      self.assertEqual(getattr(actuators, f), getattr(actuators_n, f), f)
+
+  def test_non_finite_steer(self):
+    CC = make_controller(CAR.PRIUS)
+    actuators = car.CarControl.new_message().actuators
+    actuators.steer = float('nan')
+    self.assertRaises(ValueError, run_update, CC, 0, actuators)
+
+  def test_negative_frame(self):
+    CC = make_controller(CAR.PRIUS, dsu=True)
+    static_addrs = {addr for addr, _, _, _, _ in STATIC_DSU_MSGS}
+    for frame in range(-300, 0):
+      _, can_sends = run_update(CC, frame)
+      expected = [make_can_msg(addr, vl, bus) for addr, cars, bus, fr_step, vl in STATIC_DSU_MSGS
+                  if frame % fr_step == 0 and CAR.PRIUS in cars]
+      self.assertEqual(expected, [msg for msg in can_sends if msg[0] in static_addrs])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,3 +1,12 @@
+# addresses of the messages we send, the packer takes these directly and skips its name lookup
+STEERING_LKA = 0x2E4
+STEERING_LTA = 0x191
+ACC_CONTROL = 0x343
+PCM_CRUISE = 0x1D2
+ACC_HUD = 0x411
+LKAS_HUD = 0x412
+
+
 def create_steer_command(packer, steer, steer_req, raw_cnt):
   """Creates a CAN message for the Toyota Steer Command."""
 
@@ -7,7 +16,7 @@ def create_steer_command(packer, steer, steer_req, raw_cnt):
     "COUNTER": raw_cnt,
     "SET_ME_1": 1,
   }
-  return packer.make_can_msg("STEERING_LKA", 0, values)
+  return packer.make_can_msg(STEERING_LKA, 0, values)
 
 
 def create_lta_steer_command(packer, steer, steer_req, raw_cnt):
@@ -25,7 +34,7 @@ def create_lta_steer_command(packer, steer, steer_req, raw_cnt):
     "STEER_REQUEST_2": steer_req,
     "BIT": 0,
   }
-  return packer.make_can_msg("STEERING_LTA", 0, values)
+  return packer.make_can_msg(STEERING_LTA, 0, values)
 
 
 def create_accel_command(packer, accel, pcm_cancel, standstill_req, lead, acc_type):
@@ -40,7 +49,7 @@ def create_accel_command(packer, accel, pcm_cancel, standstill_req, lead, acc_ty
     "CANCEL_REQ": pcm_cancel,
     "ALLOW_LONG_PRESS": 1,
   }
-  return packer.make_can_msg("ACC_CONTROL", 0, values)
+  return packer.make_can_msg(ACC_CONTROL, 0, values)
 
 
 def create_acc_cancel_command(packer):
@@ -52,7 +61,7 @@ def create_acc_cancel_command(packer):
     "CRUISE_STATE": 0,
     "CANCEL_REQ": 1,
   }
-  return packer.make_can_msg("PCM_CRUISE", 0, values)
+  return packer.make_can_msg(PCM_CRUISE, 0, values)
 
 
 def create_fcw_command(packer, fcw):
@@ -64,7 +73,7 @@ def create_fcw_command(packer, fcw):
     "PCS_OFF": 1,
     "PCS_SENSITIVITY": 0,
   }
-  return packer.make_can_msg("ACC_HUD", 0, values)
+  return packer.make_can_msg(ACC_HUD, 0, values)
 
 
 def create_ui_command(packer, steer, chime, left_line, right_line, left_lane_depart, right_lane_depart, enabled):
@@ -97,4 +106,4 @@ def create_ui_command(packer, steer, chime, left_line, right_line, left_lane_dep
     "ADJUSTING_CAMERA": 0,
     "LDW_EXIST": 1,
   }
-  return packer.make_can_msg("LKAS_HUD", 0, values)
+  return packer.make_can_msg(LKAS_HUD, 0, values)